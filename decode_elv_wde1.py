@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Decoder for weather data of sensors from ELV received with RTL SDR
 # Typical usage: 
@@ -28,11 +28,80 @@
 
 import sys
 import io
+import array
 import time
-import struct
 import math
 import logging
 import argparse
+import itertools
+import operator
+import typing
+import queue
+import threading
+
+# Number of bytes read from the input at once
+CHUNK_SIZE = 65536
+
+# Number of samples searched at once, small enough that little
+# work is wasted when the decoder leaves the wait state
+PIECE_SIZE = 256
+
+# Signal peaks above this level are considered as clipped
+CLIP_LEVEL = 32500
+
+# Slices of the buffer with the high and low part of the first sync bit
+SYNC_HIGH = slice(0, 20)
+SYNC_LOW = slice(26, 33)
+
+# Slices of the buffer with the start, middle and end of a bit
+# for each number of samples skipped before the bit starts
+BIT_WINDOWS = tuple((slice(skip, skip+10), slice(skip+13, skip+22), slice(skip+25, 33)) for skip in range(4))
+
+class decoder_output(object):
+  # Values decoded from the data of one sensor
+  __slots__ = ('sensor_type', 'sensor_type_str', 'address', 'temperature',
+    'humidity', 'wind', 'rain_sum', 'rain_detect', 'pressure')
+
+  def __init__(self, sensor_type: int, sensor_type_str: str, address: int, temperature: float) -> None:
+    self.sensor_type = sensor_type
+    self.sensor_type_str = sensor_type_str
+    self.address = address
+    self.temperature = temperature
+    self.humidity = 0.
+    self.wind = 0.
+    self.rain_sum = 0
+    self.rain_detect = False
+    self.pressure = 0
+
+# Computation of the values specific to a sensor type from the nibbles
+def decode_hygro(dec: typing.List[int], decoder_out: decoder_output) -> None:
+  # Thermo/Hygro
+  decoder_out.humidity = dec[6]*10. + dec[5] + dec[4]/10.
+
+def decode_hygro_baro(dec: typing.List[int], decoder_out: decoder_output) -> None:
+  # Thermo/Hygro/Baro
+  decode_hygro(dec, decoder_out)
+  decoder_out.pressure = 200 + dec[9]*100 + dec[8]*10 + dec[7]
+
+def decode_kombi(dec: typing.List[int], decoder_out: decoder_output) -> None:
+  # Kombisensor
+  decoder_out.humidity = dec[5]*10. + dec[4]
+  decoder_out.wind = dec[8]*10. + dec[7] + dec[6]/10.
+  decoder_out.rain_sum = dec[11]*16*16 + dec[10]*16 + dec[9]
+  decoder_out.rain_detect = dec[0]&2 == 1
+
+# Name, number of data nibbles and function to compute the specific
+# values for each sensor type
+SENSOR_TYPES = (
+  ('Thermo', 5, None),
+  ('Thermo/Hygro', 8, decode_hygro),
+  ('Rain(?)', 5, None),
+  ('Wind(?)', 8, None),
+  ('Thermo/Hygro/Baro', 12, decode_hygro_baro),
+  ('Luminance(?)', 6, None),
+  ('Pyrano(?)', 6, None),
+  ('Kombi', 14, decode_kombi)
+)
 
 class decoder(object):
   def __init__(self):
@@ -40,17 +109,95 @@ class decoder(object):
     # and the length of a bit is always 1220us.
     # Therefore the length of the buffer fo a whole bit is 36.6 samples.
     # Round this down to 35 avoid getting the next bit into the buffer
-    self.buf = [0] * 35
+    # The buffer is a ring with the write position buf_pos.
+    # Each sample is stored twice, at buf_pos and buf_pos + 35,
+    # so that any window of the ring is a contiguous slice.
+    # The samples are stored unboxed as signed 16-bit values.
+    self.buf = array.array('h', [0] * 70)
+    self.buf_pos = 0
     self.decoder_state = 'wait'
     self.pulse_len = 0
-    self.on_level = 0
+    self.on_level = 0.
     self.sync_count = 0
-    self.data = []
+    # The received bits are kept in an integer, the first bit
+    # in the least significant position, and nbits is their count
+    self.bits = 0
+    self.nbits = 0
     self.clipped = 0
 
-  def process(self, value):
-    self.buf.pop(0)
-    self.buf.append(value)
+  def process_block(self, samples: typing.Sequence[int]) -> None:
+    # Process a block of samples, e.g. a memoryview
+    # of signed 16-bit values as read from the input
+    process = self.process
+    i = 0
+    n = len(samples)
+    while i < n:
+      if self.pulse_len < 35:
+        # buffer not filled, so the next samples are not decoded
+        count = min(35 - self.pulse_len, n - i)
+        self.fill(samples[i:i + count])
+        i += count
+      elif self.decoder_state == 'wait' and self.clipped % 10000 != 1:
+        # Search in pieces, because the decoder may leave
+        # the wait state after a few samples
+        i = self.search_sync0(samples, i, min(n, i + PIECE_SIZE))
+      else:
+        process(samples[i])
+        i += 1
+
+  def search_sync0(self, samples: typing.Sequence[int], start: int, end: int) -> int:
+    # Same as calling process() for the samples from start to end while
+    # waiting for the first sync bit, but only calls test_sync0 for
+    # samples where the high and low averages look like a sync bit.
+    # The averages are computed from prefix sums of the samples.
+    # Returns the index of the next sample to process.
+    self.sync_count = 0
+    self.bits = 0
+    self.nbits = 0
+    # sums are the prefix sums of the buffer followed by the samples,
+    # so after processing samples[start + j] the buffer sums up to
+    # sums[j+36] - sums[j+1]
+    seq = self.window(0, 35).tolist()
+    seq.extend(samples[start:end])
+    sums = [0]
+    sums.extend(itertools.accumulate(seq))
+    # test_sync0 rejects a sample if avh < avl * 2 with avh = high/20
+    # and avl = low/7, which is the same as 7 * high < 40 * low for the
+    # integer sums. Select the other samples without a Python loop.
+    high = map(operator.sub, sums[SYNC_HIGH.stop + 1:], sums[SYNC_HIGH.start + 1:])
+    low = map(operator.sub, sums[SYNC_LOW.stop + 1:], sums[SYNC_LOW.start + 1:])
+    high_factor = SYNC_LOW.stop - SYNC_LOW.start
+    low_factor = 2 * (SYNC_HIGH.stop - SYNC_HIGH.start)
+    candidates = itertools.compress(range(end - start),
+      map(operator.ge, map(high_factor.__mul__, high), map(low_factor.__mul__, low)))
+    test_sync0 = self.test_sync0
+    for j in candidates:
+      test_sync0(seq[j + 1:j + 36])
+      if self.decoder_state != 'wait':
+        self.fill(samples[start:start + j + 1])
+        self.pulse_len = 0 # the sync bit ends with this sample
+        return start + j + 1
+      if self.clipped % 10000 == 1:
+        self.fill(samples[start:start + j + 1])
+        return start + j + 1
+    self.fill(samples[start:end])
+    return end
+
+  def fill(self, samples: typing.Sequence[int]) -> None:
+    # Put samples into the buffer without decoding them,
+    # only the last 35 samples end up in the buffer
+    window = self.window(min(len(samples), 35), 35)
+    window.extend(samples[-35:])
+    self.buf = window + window
+    self.buf_pos = 0
+    self.pulse_len += len(samples)
+
+  def process(self, value: int) -> None:
+    pos = self.buf_pos
+    self.buf[pos] = value
+    self.buf[pos + 35] = value
+    pos += 1
+    self.buf_pos = pos if pos < 35 else 0
     self.pulse_len += 1
     if self.pulse_len <= 35:
       return # buffer not filled
@@ -60,11 +207,12 @@ class decoder(object):
 
     if self.decoder_state == 'wait':
       self.sync_count = 0
-      self.data = []
-      self.test_sync0() # search for first sync bit
+      self.bits = 0
+      self.nbits = 0
+      self.test_sync0(self.window(0, 35)) # search for first sync bit
     else:
       val = self.bitval()
-      logging.debug("bitval = {0}".format(val))
+      logging.debug("bitval = %s", val)
       if val == -1:
         # Failed to decode bitval
         self.decoder_state = 'wait'
@@ -82,20 +230,22 @@ class decoder(object):
           logging.info('DATA')
           self.decoder_state = 'data'
       elif self.decoder_state == 'data':
-        self.data.append(val)
+        self.bits |= val << self.nbits
+        self.nbits += 1
 
-  def test_sync0(self):
-    # Test if the data in the buffer is the first sync bit
+  def test_sync0(self, window: typing.Sequence[int]) -> None:
+    # Test if the window of the last 35 samples is the first sync bit
     # This bit consists of high amplitude with ~21 samples
     # and low amplitude with ~10 samples
-    
-    avh = self.signal_avr(0, 20)
-    avl = self.signal_avr(26, 33)
+    high = window[SYNC_HIGH]
+    low = window[SYNC_LOW]
+    avh = self.signal_avr(high)
+    avl = self.signal_avr(low)
     if avh < avl * 2:
       return # high signal ampl. should be greater than low
 
-    rgh = self.signal_range(0, 20)
-    rgl = self.signal_range(26, 33)
+    rgh = self.signal_range(high)
+    rgl = self.signal_range(low)
     if avh < rgh or avh < rgl:
       return # average of high signal amplitude should be greater than noise
     
@@ -104,32 +254,37 @@ class decoder(object):
     self.on_level = (avh+avl)/2
     self.pulse_len = 0
     logging.info("SYNC!")
-    logging.debug("avh={0} avl={1}".format(avh, avl))
+    logging.debug("avh=%s avl=%s", avh, avl)
     return
   
-  def signal_avr(self, begin, end):
-    sm = sum(self.buf[begin:end])
-    return sm/(end-begin) 
-
-  def signal_range(self, begin, end):
-    mn = min(self.buf[begin:end])
-    mx = max(self.buf[begin:end])
-    if mx > 32500 or mn < -32500:
+  def window(self, begin: int, end: int) -> 'array.array[int]':
+    # Samples from begin to end, where 0 is the oldest sample in the buffer
+    return self.buf[self.buf_pos + begin:self.buf_pos + end]
+
+  def signal_avr(self, samples: typing.Sequence[int]) -> float:
+    sm = sum(samples)
+    return sm/len(samples)
+
+  def signal_range(self, samples: typing.Sequence[int]) -> int:
+    mn = min(samples)
+    mx = max(samples)
+    if max(mx, -mn) > CLIP_LEVEL:
       self.clipped += 1 
     return mx-mn
 
-  def bitval(self):
+  def bitval(self) -> int:
     # detect start of bit: the signal shouldnow be at off level, 
     # so detect a transition to on
+    window = self.window(0, 35)
+    on_level = self.on_level
     skip = 0
     while skip < 4:
-      x = self.buf[skip]
-      if x > self.on_level:
+      if window[skip] > on_level:
         break
       skip += 1
 
     self.pulse_len = -skip
-    logging.debug("skip={0}".format(skip))
+    logging.debug("skip=%s", skip)
     if skip >= 4:
       logging.debug("No starting slope off->on deteced")
       return -10 
@@ -137,11 +292,12 @@ class decoder(object):
     # first 12 samples always high signal
     # but allow a jitter of 1 sample
     val = -1
-    aa = self.signal_avr(skip, skip+10);
+    start, middle, end = BIT_WINDOWS[skip]
+    aa = self.signal_avr(window[start])
     # Next 12 samples either low or high depending on bitval 
-    ma = self.signal_avr(skip+13, skip+22)
+    ma = self.signal_avr(window[middle])
     # last 12 samples should be always low signal
-    ea = self.signal_avr(skip+25, 33)
+    ea = self.signal_avr(window[end])
 
     if aa > ea:
       if abs(ma-aa) > abs(ma-ea):
@@ -150,22 +306,20 @@ class decoder(object):
         val = 0 
 
     self.on_level = (aa+ea)/2
-    logging.debug("bitval: a={0} m={1} e={2} val={3}".format(aa, ma, ea, val))
+    logging.debug("bitval: a=%s m=%s e=%s val=%s", aa, ma, ea, val)
     return val
      
-  def popbits(self, num):
-    val = 0
-    if len(self.data) < num:
+  def popbits(self, num: int) -> int:
+    if self.nbits < num:
       logging.warn("data exhausted")
       return 0
-    for i in range(0, num): 
-      val += self.data.pop(0) << i
+    # The bits are sent LSB first, which is the order they are stored in
+    val = self.bits & ((1 << num) - 1)
+    self.bits >>= num
+    self.nbits -= num
     return val
 
-  def decode(self):
-    sensor_types = ('Thermo', 'Thermo/Hygro', 'Rain(?)', 'Wind(?)', 'Thermo/Hygro/Baro', 'Luminance(?)', 'Pyrano(?)', 'Kombi')
-    sensor_data_count = (5, 8, 5, 8, 12, 6, 6, 14)
-
+  def decode(self) -> None:
     logging.info("DECODE")
     check = 0
     sum = 0
@@ -176,7 +330,7 @@ class decoder(object):
     sum += sensor_type
 
     # read data as nibbles
-    nibble_count = sensor_data_count[sensor_type]
+    sensor_type_str, nibble_count, decode_values = SENSOR_TYPES[sensor_type]
     dec = []
     for i in range(0, nibble_count):
       nibble = self.popbits(4)
@@ -188,7 +342,7 @@ class decoder(object):
 
     # check
     if check != 0:
-      logging.warn("Check is not 0 but {0}".format(check))
+      logging.warn("Check is not 0 but %s", check)
       return
 
     # sum
@@ -196,68 +350,64 @@ class decoder(object):
     sum += 5
     sum &= 0xF
     if sum_read != sum:
-      logging.warn("Sum read is {0} but computed is {1}".format(sum_read, sum))
+      logging.warn("Sum read is %s but computed is %s", sum_read, sum)
       return
 
     # compute values
-    decoder_out = {
-      'sensor_type': sensor_type,
-      'sensor_type_str': sensor_types[sensor_type],
-      'address': dec[0] & 7,
-      'temperature': (dec[3]*10. + dec[2] + dec[1]/10.) * (-1. if dec[0]&8 else 1.),
-      'humidity': 0.,
-      'wind': 0.,
-      'rain_sum': 0,
-      'rain_detect': 0,
-      'pressure': 0
-    }
-  
-    if sensor_type == 7:
-      # Kombisensor
-      decoder_out['humidity'] = dec[5]*10. + dec[4]
-      decoder_out['wind'] = dec[8]*10. + dec[7] + dec[6]/10.
-      decoder_out['rain_sum'] = dec[11]*16*16 + dec[10]*16 + dec[9]
-      decoder_out['rain_detect'] = dec[0]&2 == 1
-
-    if (sensor_type == 1) or (sensor_type == 4):
-      # Thermo/Hygro
-      decoder_out['humidity'] = dec[6]*10. + dec[5] + dec[4]/10.
-
-    if sensor_type == 4:
-      # Thermo/Hygro/Baro
-      decoder_out['pressure'] = 200 + dec[9]*100 + dec[8]*10 + dec[7]
+    decoder_out = decoder_output(sensor_type, sensor_type_str, dec[0] & 7,
+      (dec[3]*10. + dec[2] + dec[1]/10.) * (-1. if dec[0]&8 else 1.))
+    if decode_values is not None:
+      decode_values(dec, decoder_out)
 
     self.print_decoder_output(decoder_out)
 
   def print_decoder_output(self, decoder_out):
     print(time.strftime("time: %x %X"))
-    print("sensor type: " + decoder_out['sensor_type_str'])
-    print("address: {0}".format(decoder_out['address']))
+    print("sensor type: " + decoder_out.sensor_type_str)
+    print("address: {0}".format(decoder_out.address))
 
-    print("temperature: {0}".format(decoder_out['temperature']))
+    print("temperature: {0}".format(decoder_out.temperature))
 
-    if decoder_out['sensor_type'] == 7:
+    if decoder_out.sensor_type == 7:
       # Kombisensor
-      print("humidity: {0}".format(decoder_out['humidity']))
-      print("wind: {0}".format(decoder_out['wind']))
-      print("rain sum: {0}".format(decoder_out['rain_sum']))
-      print("rain detector: {0}".format(decoder_out['rain_detect']))
-    if (decoder_out['sensor_type'] == 1) or (decoder_out['sensor_type'] == 4):
+      print("humidity: {0}".format(decoder_out.humidity))
+      print("wind: {0}".format(decoder_out.wind))
+      print("rain sum: {0}".format(decoder_out.rain_sum))
+      print("rain detector: {0}".format(decoder_out.rain_detect))
+    if (decoder_out.sensor_type == 1) or (decoder_out.sensor_type == 4):
       # Thermo/Hygro
-      print("humidity: {0}".format(decoder_out['humidity']))
-    if decoder_out['sensor_type'] == 4:
+      print("humidity: {0}".format(decoder_out.humidity))
+    if decoder_out.sensor_type == 4:
       # Thermo/Hygro/Baro
-      print("pressure: {0}".format(decoder_out['pressure']))
+      print("pressure: {0}".format(decoder_out.pressure))
 
     print
       
-  def expect_eon(self):
+  def expect_eon(self) -> bool:
     # check end of nibble (1)
     if self.popbits(1) != 1:
       logging.warn("end of nibble is not 1")
       return False
     return True
 
+def read_blocks(fin, free, filled):
+  # Read the input into the buffers taken from free and pass them to
+  # filled together with the number of bytes read. This runs in its own
+  # thread, so that reading from a pipe overlaps with decoding.
+  # The end of input is signalled with 0 bytes and None, or the
+  # exception if reading failed.
+  try:
+    b = free.get()
+    n = fin.readinto(b)
+    while n:
+      filled.put((b, n))
+      b = free.get()
+      n = fin.readinto(b)
+  except BaseException as e:
+    filled.put((e, 0))
+  else:
+    filled.put((None, 0))
+
 def main():
   parser = argparse.ArgumentParser(description='Decoder for weather data of sensors from ELV received with RTL SDR.')
   parser.add_argument('--log', type=str, default='WARN', help='Log level: DEBUG|INFO|WARN|ERROR. Default: WARN')
@@ -277,14 +427,26 @@ def main():
   if filename == '-':
     filename = sys.stdin.fileno()
   fin = io.open(filename, mode="rb")
-  b = fin.read(512)
-  while len(b) == 512:
-    values = struct.unpack('256h', b)
-    for val in values:
-      dec.process(val)
-    b = fin.read(512)
+  # Two reusable buffers are passed back and forth between the reader
+  # thread and the decoder, the samples are passed as memoryview
+  # to the decoder to avoid copying them
+  free = queue.Queue()
+  filled = queue.Queue()
+  for i in range(2):
+    free.put(bytearray(CHUNK_SIZE))
+  reader = threading.Thread(target=read_blocks, args=(fin, free, filled))
+  reader.daemon = True
+  reader.start()
+  b, n = filled.get()
+  while n:
+    dec.process_block(memoryview(b)[:n - n % 2].cast('h'))
+    free.put(b)
+    b, n = filled.get()
 
   fin.close()
+  if b is not None:
+    # reading failed in the reader thread
+    raise b
 
 if __name__ == '__main__':
   main()
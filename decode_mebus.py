@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Decoder for weather data of sensors from Mebus received with RTL SDR
 # Typical usage: 
@@ -28,94 +28,245 @@
 import sys
 import io
 import time
-import struct
 import math
 import logging
 import argparse
+import itertools
+import operator
+import typing
+import queue
+import threading
+
+# Number of bytes read from the input at once
+CHUNK_SIZE = 65536
+
+# Number of samples searched or thresholded at once, small enough
+# that little work is wasted when the decoder changes its state
+PIECE_SIZE = 1024
+
+# Signal peaks above this level are considered as clipped
+CLIP_LEVEL = 32500
+
+# Slices of the buffer with the three high and low levels of the sync block
+SYNC_HIGH = (slice(0, 10), slice(35, 40), slice(65, 70))
+SYNC_LOW = (slice(20, 25), slice(50, 55), slice(80, 90))
+
+# States of the decoder
+WAIT, SYNC, START, DATA, REPEAT_1, REPEAT_2 = range(6)
+
+# Translation of bit values 0 and 1 into binary digits
+BIT_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
 
 class decoder(object):
+  __slots__ = ('buf', 'buf_pos', 'decoder_state', 'pulse_len', 'clipped',
+    'noise_level', 'signal_state', 'data', 'data_pos', 'frames',
+    'pulse_border', 'pulse_limit')
+
   def __init__(self):
     # Because we are sampling at 30khz (33.3us),
     # the length of the sync block is about 90 samples.
-    self.buf = [0] * 90
-    self.decoder_state = 'wait'
+    # The buffer is a ring with the write position buf_pos.
+    # Each sample is stored twice, at buf_pos and buf_pos + 90,
+    # so that any window of the ring is a contiguous slice
+    # starting at buf_pos.
+    self.buf = [0] * 180
+    self.buf_pos = 0
+    self.decoder_state = WAIT
     self.pulse_len = 0
     self.clipped = 0
-    self.noise_level = 0
+    self.noise_level = 0.
     self.signal_state = 0
-    self.data = []
+    self.data = bytearray() # the received bits, one per byte
+    self.data_pos = 0 # read position of popbits in data
     self.frames = []
     self.pulse_border = 88 # distinguish between logical 0 and 1
     self.pulse_limit = 177 # to determine the end of a packet
 
-  def reset(self):
+  def reset(self) -> None:
     logging.info("WAITING...")
-    self.decoder_state = 'wait'
+    self.decoder_state = WAIT
     self.frames = []
     self.pulse_len = 0
 
-  def repeat(self):
+  def repeat(self) -> None:
     logging.info("REPEATING...")
     self.frames.append(self.data)
-    self.decoder_state = 'repeat_1'
+    self.decoder_state = REPEAT_1
 
-  def process(self, value):
-    self.buf.pop(0)
-    self.buf.append(value)
-    self.pulse_len += 1
-
-    if self.clipped % 10000 == 1:
-      logging.error("Clipped signal detected, you should reduce gain of receiver!")
-
-    if self.decoder_state == 'wait': 
-      if self.pulse_len > 90:
-        self.test_sync_block()
+  def process_block(self, samples: typing.Sequence[int]) -> None:
+    # Process a block of samples, e.g. a memoryview
+    # of signed 16-bit values as read from the input
+    i = 0
+    n = len(samples)
+    while i < n:
+      if self.decoder_state == WAIT and self.pulse_len < 90:
+        # buffer not filled, so the next samples are not tested
+        count = min(90 - self.pulse_len, n - i)
+        self.fill(samples[i:i + count])
+        i += count
+      elif self.decoder_state == WAIT:
+        # Search in pieces, because the decoder may leave
+        # the wait state after a few samples
+        i = self.search_sync_block(samples, i, min(n, i + PIECE_SIZE))
+      else:
+        # Compute the signal states in pieces, because the decoder
+        # may return to the wait state after a few pulses
+        i = self.process_pulses(samples, i, min(n, i + PIECE_SIZE))
+
+  def search_sync_block(self, samples: typing.Sequence[int], start: int, end: int) -> int:
+    # Same as calling process() for the samples from start to end while
+    # waiting for a sync block, but only calls test_sync_block for
+    # samples where the first high and low averages look like a sync block.
+    # The averages are computed from prefix sums of the samples.
+    # Returns the index of the next sample to process.
+    # sums are the prefix sums of the buffer followed by the samples,
+    # so after processing samples[start + j] the buffer sums up to
+    # sums[j+91] - sums[j+1]
+    seq = self.window(0, 90)
+    seq.extend(samples[start:end])
+    sums = [0]
+    sums.extend(itertools.accumulate(seq))
+    # test_sync_block rejects a sample if avh0 < avl0 * 2, which is always
+    # the case if 5 * high < 20 * low for the integer sums of the first high
+    # and low level. Select the other samples without a Python loop.
+    high0 = SYNC_HIGH[0]
+    low0 = SYNC_LOW[0]
+    high = map(operator.sub, sums[high0.stop + 1:], sums[high0.start + 1:])
+    low = map(operator.sub, sums[low0.stop + 1:], sums[low0.start + 1:])
+    high_factor = low0.stop - low0.start
+    low_factor = 2 * (high0.stop - high0.start)
+    candidates = itertools.compress(range(end - start),
+      map(operator.ge, map(high_factor.__mul__, high), map(low_factor.__mul__, low)))
+    test_sync_block = self.test_sync_block
+    for j in candidates:
+      test_sync_block(seq[j + 1:j + 91])
+      if self.decoder_state != WAIT:
+        self.fill(samples[start:start + j + 1])
+        self.pulse_len = 0 # the sync block ends with this sample
+        return start + j + 1
+    self.fill(samples[start:end])
+    return end
+
+  def fill(self, samples: typing.Sequence[int]) -> None:
+    # Put samples into the buffer without decoding them,
+    # only the last 90 samples end up in the buffer
+    window = self.window(min(len(samples), 90), 90)
+    window.extend(samples[-90:])
+    self.buf = window + window
+    self.buf_pos = 0
+    self.pulse_len += len(samples)
+
+  def process_pulses(self, samples: typing.Sequence[int], start: int, end: int) -> int:
+    # Same as calling process() for the samples from start to end after
+    # a sync block was found, but only visits the samples where the
+    # signal state changes or a pulse gets too long.
+    # Returns the index of the next sample to process.
+    # The signal states of all samples are computed at once in C.
+    # For integer samples, value > noise_level is the same as
+    # value > floor(noise_level), which compares two ints.
+    threshold = math.floor(self.noise_level)
+    states = bytes(map(threshold.__lt__, samples[start:end]))
+    n = len(states)
+    pos = 0
+    while pos < n:
+      signal_state = self.signal_state
+      edge = states.find(b'\x00' if signal_state else b'\x01', pos)
+      if edge < 0:
+        edge = n
+      run = edge - pos
+      if signal_state == 0:
+        if (self.decoder_state == DATA) and (self.pulse_len + run > self.pulse_limit):
+          # end of frame
+          count = self.pulse_limit + 1 - self.pulse_len
+          self.pulse_len += count
+          run -= count
+          self.dump()
+          self.repeat()
+        if (self.decoder_state == REPEAT_2) and (self.pulse_len + run > 2 * self.pulse_limit):
+          # End of packet
+          count = 2 * self.pulse_limit + 1 - self.pulse_len
+          self.pulse_len += count
+          self.decode()
+          self.reset()
+          return start + pos + count
+      self.pulse_len += run
+      if edge == n:
+        break
+      # the sample at edge changes the signal state
+      self.pulse_len += 1
+      if signal_state == 0:
+        self.signal_goto_on()
+      else:
+        self.signal_goto_off()
+      self.signal_state = 1 - signal_state
+      pos = edge + 1
+      if self.decoder_state == WAIT:
+        return start + pos
+    return start + n
+
+  def process(self, value: int) -> None:
+    buf = self.buf
+    pos = self.buf_pos
+    buf[pos] = value
+    buf[pos + 90] = value
+    pos += 1
+    self.buf_pos = pos if pos < 90 else 0
+    pulse_len = self.pulse_len + 1
+    self.pulse_len = pulse_len
+
+    decoder_state = self.decoder_state
+    if decoder_state == WAIT: 
+      if pulse_len > 90:
+        self.test_sync_block(self.window(0, 90))
       return
 
     # at this point we have a valid sync block and know the noise_level
     # to detect pulses
     next_signal_state = 1 if value > self.noise_level else 0
-    if self.signal_state == 0:
+    signal_state = self.signal_state
+    if signal_state == 0:
       if next_signal_state == 0:
-        if (self.decoder_state == 'data') and (self.pulse_len > self.pulse_limit):
+        if (decoder_state == DATA) and (pulse_len > self.pulse_limit):
           # end of frame
           self.dump()
           self.repeat()
-        if (self.decoder_state == 'repeat_2') and (self.pulse_len > 2 * self.pulse_limit):
+        elif (decoder_state == REPEAT_2) and (pulse_len > 2 * self.pulse_limit):
           # End of packet
           self.decode()
           self.reset()
       else:
         self.signal_goto_on()
-    elif self.signal_state == 1:
+    elif signal_state == 1:
       if next_signal_state == 0:
         self.signal_goto_off()
     self.signal_state = next_signal_state
 
-  def test_sync_block(self):
+  def test_sync_block(self, window: typing.List[int]) -> None:
     # A valid sync block has the levels on-off-on-off-on-off.
     # Each level has a duration of avr. 15 samples. 
     # But allow a jitter of 5 samples for each level change.
-    avh0 = self.signal_avr(0, 10)
-    avl0 = self.signal_avr(20, 25)
+    high0 = window[SYNC_HIGH[0]]
+    low0 = window[SYNC_LOW[0]]
+    avh0 = self.signal_avr(high0)
+    avl0 = self.signal_avr(low0)
     if avh0 < avl0 * 2:
       return # high signal ampl. should be greater than low
 
-    rgh0 = self.signal_range(0, 10)
-    rgl0 = self.signal_range(20, 25)
+    rgh0 = self.signal_range(high0)
+    rgl0 = self.signal_range(low0)
     if avh0 < rgh0 or avh0 < rgl0:
       return # average of high signal amplitude should be greater than noise
 
-    avh1 = self.signal_avr(35, 40)
-    avl1 = self.signal_avr(50, 55)
+    avh1 = self.signal_avr(window[SYNC_HIGH[1]])
+    avl1 = self.signal_avr(window[SYNC_LOW[1]])
     if avh1 < avl1 * 2:
       return # high signal ampl. of second pulse should be greater than low
 
     if avh1 < avl0 or avh0 < avl1:
       return # high of second pluse should be greate than low of first
 
-    avh2 = self.signal_avr(65, 70)
-    avl2 = self.signal_avr(80, 90)
+    avh2 = self.signal_avr(window[SYNC_HIGH[2]])
+    avl2 = self.signal_avr(window[SYNC_LOW[2]])
     if avh2 < avl2 * 2:
       return # high signal ampl. of third pulse should be greater than low
 
@@ -123,96 +274,106 @@ class decoder(object):
       return # high of third pluse should be greater than low of first
 
     # Valid sync block found!
-    self.decoder_state = 'sync'
+    self.decoder_state = SYNC
     self.signal_state = 0
     self.noise_level = (avh0 + avl0 + avh1 + avl1 + avh2 + avl2) / 6
     self.pulse_len = 0
     logging.info("SYNC!")
-    logging.debug("noise_level={0}".format(self.noise_level))
-
-  def signal_avr(self, begin, end):
-    sm = sum(self.buf[begin:end])
-    return sm/(end-begin) 
-
-  def signal_range(self, begin, end):
-    mn = min(self.buf[begin:end])
-    mx = max(self.buf[begin:end])
-    if mx > 32500 or mn < -32500:
-      self.clipped += 1 
+    logging.debug("noise_level=%s", self.noise_level)
+
+  def window(self, begin: int, end: int) -> typing.List[int]:
+    # Samples from begin to end, where 0 is the oldest sample in the buffer
+    return self.buf[self.buf_pos + begin:self.buf_pos + end]
+
+  def signal_avr(self, samples: typing.Sequence[int]) -> float:
+    sm = sum(samples)
+    return sm/len(samples)
+
+  def signal_range(self, samples: typing.Sequence[int]) -> int:
+    mn = min(samples)
+    mx = max(samples)
+    if max(mx, -mn) > CLIP_LEVEL:
+      self.clipped += 1
+      if self.clipped & 0x1FFF == 1:
+        # the first time and then every 8192 clipped windows
+        logging.error("Clipped signal detected, you should reduce gain of receiver!")
     return mx-mn
 
-  def signal_goto_on(self):
+  def signal_goto_on(self) -> None:
     self.signal_off(self.pulse_len)
     self.pulse_len = 0
 
-  def signal_goto_off(self):
+  def signal_goto_off(self) -> None:
     self.signal_on(self.pulse_len)
     self.pulse_len = 0
 
-  def signal_on(self, length):
-    logging.debug(" ON: {0}".format(length))
-    if self.decoder_state == 'sync':
-      self.decoder_state = 'start'
-    if self.decoder_state == 'repeat_1':
-      self.decoder_state = 'repeat_2'
+  def signal_on(self, length: int) -> None:
+    logging.debug(" ON: %s", length)
+    if self.decoder_state == SYNC:
+      self.decoder_state = START
+    if self.decoder_state == REPEAT_1:
+      self.decoder_state = REPEAT_2
 
-  def signal_off(self, length):
-    logging.debug("OFF: {0}".format(length))
-    if self.decoder_state == 'repeat_2':
+  def signal_off(self, length: int) -> None:
+    logging.debug("OFF: %s", length)
+    if self.decoder_state == REPEAT_2:
       self.expect_repeat(self.bitval(length))
-    elif self.decoder_state == 'start':
+    elif self.decoder_state == START:
       self.expect_start(self.bitval(length))
-    elif self.decoder_state == 'data':
-      self.data.append(self.bitval(length))
-
-  def bitval(self, length):
-    if length < self.pulse_border:
+    elif self.decoder_state == DATA:
+      value = self.bitval(length)
+      if value is not None: # None after a reset
+        self.data.append(value)
+
+  def bitval(self, length: int) -> typing.Optional[int]:
+    border = self.pulse_border
+    if length < border:
       return 0
-    if (length > self.pulse_border) and (length < self.pulse_limit):
+    if border < length < self.pulse_limit:
       return 1
     logging.warn("off pulse too long")
     self.reset()
+    return None
 
-  def expect_start(self, value):
+  def expect_start(self, value: typing.Optional[int]) -> None:
     if value == 1:
-      self.data = []
-      self.decoder_state = 'data'
+      self.data = bytearray()
+      self.data_pos = 0
+      self.decoder_state = DATA
       logging.info("START")
     else:
       logging.warn("Start bit is not 1")
       self.reset()
 
-  def expect_repeat(self, value):
+  def expect_repeat(self, value: typing.Optional[int]) -> None:
     if value == 0:
-      self.data = []
-      self.decoder_state = 'start'
+      self.data = bytearray()
+      self.data_pos = 0
+      self.decoder_state = START
       logging.info("REPEAT")
     else:
       logging.warn("Repeat bit is not 0")
       self.reset()
 
-  def popbits(self, num):
-    val = 0
-    if len(self.data) < num:
+  def popbits(self, num: int) -> int:
+    pos = self.data_pos
+    if len(self.data) - pos < num:
       logging.warn("data exhausted")
       return 0
-    for i in range(0, num): 
-      val <<= 1
-      val += self.data.pop(0)
-    return val
+    self.data_pos = pos + num
+    # The bits are sent MSB first, so let int() parse them as binary digits
+    return int(self.data[pos:pos + num].translate(BIT_DIGITS), 2)
 
-  def dump(self):
+  def dump(self) -> None:
     logging.info("DUMP Frame")
-    s = ''
-    i = 0
-    for d in self.data:
-      if i%4 == 0:
-        s += ' '
-      s += str(d)
-      i += 1
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+      return
+    # the bits in groups of four, each preceded by a space
+    bits = self.data.translate(BIT_DIGITS).decode()
+    s = ''.join([' ' + bits[i:i+4] for i in range(0, len(bits), 4)])
     logging.info(s) 
 
-  def decode(self):
+  def decode(self) -> None:
     logging.info("DECODE")
     if len(self.frames) == 0:
       logging.warn("Frame contains no data")
@@ -223,28 +384,58 @@ class decoder(object):
     check = self.frames[0]
     for i in range(1, len(self.frames)):
       if check != self.frames[i]:
-        logging.warn("Frame {0} is not equals to first one".format(i))
+        logging.warn("Frame %s is not equals to first one", i)
         self.reset()
         return
 
-    id = self.popbits(11)
-    setkey = self.popbits(1)
-    channel = self.popbits(2)
-    temp = self.popbits(12) 
+    if len(self.data) - self.data_pos >= 34:
+      # the frame contains all fields, so read them at once
+      packed = self.popbits(34)
+      id = packed >> 23
+      setkey = (packed >> 22) & 0x1
+      channel = (packed >> 20) & 0x3
+      temp = (packed >> 8) & 0xFFF
+      hum = packed & 0xFF
+    else:
+      id = self.popbits(11)
+      setkey = self.popbits(1)
+      channel = self.popbits(2)
+      temp = self.popbits(12)
+      hum = self.popbits(8)
     if temp >= 2048:
       # negative value
       temp = temp - 4096
-    hum = self.popbits(8)
 
+    self.print_decoder_output(id, setkey, channel + 1, temp/10.0, hum)
+
+  def print_decoder_output(self, id, setkey, channel, temperature, humidity):
     print(time.strftime("time: %x %X"))
     print("id: {0}".format(id))
     print("setkey: {0}".format(setkey))
-    print("channel: {0}".format(channel + 1))
-    print("temperature: {0}".format(temp/10.0))
-    print("humidity: {0}".format(hum))
+    print("channel: {0}".format(channel))
+    print("temperature: {0}".format(temperature))
+    print("humidity: {0}".format(humidity))
 
     print
       
+def read_blocks(fin, free, filled):
+  # Read the input into the buffers taken from free and pass them to
+  # filled together with the number of bytes read. This runs in its own
+  # thread, so that reading from a pipe overlaps with decoding.
+  # The end of input is signalled with 0 bytes and None, or the
+  # exception if reading failed.
+  try:
+    b = free.get()
+    n = fin.readinto(b)
+    while n:
+      filled.put((b, n))
+      b = free.get()
+      n = fin.readinto(b)
+  except BaseException as e:
+    filled.put((e, 0))
+  else:
+    filled.put((None, 0))
+
 def main():
   parser = argparse.ArgumentParser(description='Decoder for weather data of sensors from Mebus received with RTL SDR')
   parser.add_argument('--log', type=str, default='WARN', help='Log level: DEBUG|INFO|WARN|ERROR. Default: WARN')
@@ -264,14 +455,26 @@ def main():
   if filename == '-':
     filename = sys.stdin.fileno()
   fin = io.open(filename, mode="rb")
-  b = fin.read(512)
-  while len(b) == 512:
-    values = struct.unpack('256h', b)
-    for val in values:
-      dec.process(val)
-    b = fin.read(512)
+  # Two reusable buffers are passed back and forth between the reader
+  # thread and the decoder, the samples are passed as memoryview
+  # to the decoder to avoid copying them
+  free = queue.Queue()
+  filled = queue.Queue()
+  for i in range(2):
+    free.put(bytearray(CHUNK_SIZE))
+  reader = threading.Thread(target=read_blocks, args=(fin, free, filled))
+  reader.daemon = True
+  reader.start()
+  b, n = filled.get()
+  while n:
+    dec.process_block(memoryview(b)[:n - n % 2].cast('h'))
+    free.put(b)
+    b, n = filled.get()
 
   fin.close()
+  if b is not None:
+    # reading failed in the reader thread
+    raise b
 
 if __name__ == '__main__':
   main()
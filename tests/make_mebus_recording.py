@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Generator of the synthetic recording mebus-30k-1.raw for test_decode_mebus
+# Usage:
+# ./make_mebus_recording.py > mebus-30k-1.raw
+#
+# The recording has signed 16-bit samples in platform default byte order
+# at 30 kHz, like the output of rtl_fm -M am -s 30k. The signal is 10000
+# when the transmitter is on and 0 when it is off, each sample with
+# uniform noise of +-300. The noise comes from random with a fixed seed,
+# so the output is the same on every run.
+
+import random
+import struct
+import sys
+
+samples = []
+
+# Append n samples of the on (high) or off level
+def level(n, high):
+  for i in range(n):
+    samples.append((10000 if high else 0) + random.randint(-300, 300))
+
+# The n bits of value, MSB first
+def bits(value, n):
+  return [(value >> (n - 1 - i)) & 1 for i in range(n)]
+
+# The sync block: three short on-off pulses
+def sync():
+  for i in range(3):
+    level(15, 1)
+    level(15, 0)
+
+# A frame: the start bit 1 and the data bits, each as an on pulse
+# followed by a long (1) or short (0) off pulse, and a final on pulse
+def frame(data):
+  level(15, 1)
+  level(120, 0)
+  for b in data:
+    level(15, 1)
+    level(120 if b else 40, 0)
+  level(15, 1)
+
+# A packet of nframes equal frames of 34 bits, separated by repeat bits 0
+def packet(id, channel, temp, hum, nframes=3, setkey=0):
+  data = bits(id, 11) + [setkey] + bits(channel, 2) + bits(temp & 0xFFF, 12) + bits(hum, 8)
+  level(300, 0)
+  sync()
+  frame(data)
+  for i in range(nframes - 1):
+    level(200, 0)
+    level(15, 1)
+    level(40, 0) # repeat bit 0
+    frame(data)
+  level(200, 0)
+  level(15, 1)
+  level(400, 0)
+
+def main():
+  random.seed(1)
+
+  # Valid packets, channel is 0..3 and temp in 1/10 degrees
+  packet(1234, 2, 215, 55)
+  packet(77, 0, -32, 90, 2, 1)
+  level(1000, 0)
+  packet(2047, 3, 999, 1, 4)
+  level(1000, 0)
+
+  # Start bit 0
+  level(300, 0)
+  sync()
+  level(15, 1)
+  level(40, 0)
+  level(15, 1)
+  level(300, 0)
+
+  # Repeat bit 1
+  level(300, 0)
+  sync()
+  frame(bits(5, 34))
+  level(200, 0)
+  level(15, 1)
+  level(120, 0)
+  level(15, 1)
+  level(300, 0)
+
+  # Off pulse too long in the data
+  level(300, 0)
+  sync()
+  level(15, 1)
+  level(120, 0)
+  level(15, 1)
+  level(40, 0)
+  level(15, 1)
+  level(170, 0)
+  level(15, 1)
+  level(300, 0)
+
+  # Noise bursts
+  for i in range(200):
+    level(random.randint(1, 40), random.random() < 0.5)
+  level(2000, 0)
+
+  # Frames differ
+  level(300, 0)
+  sync()
+  frame(bits(12345, 34))
+  level(200, 0)
+  level(15, 1)
+  level(40, 0)
+  frame(bits(12346, 34))
+  level(200, 0)
+  level(15, 1)
+  level(400, 0)
+  level(1000, 0)
+
+  # Whole blocks of 512 bytes
+  n = len(samples) - len(samples) % 256
+  sys.stdout.buffer.write(struct.pack('{0}h'.format(n), *samples[:n]))
+
+if __name__ == '__main__':
+  main()
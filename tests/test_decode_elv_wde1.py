@@ -13,8 +13,13 @@ from decode_elv_wde1 import decoder
 # Test hook: store the decoder output into an instance variable
 # instead of printing it
 class test_decoder(decoder):
+  def __init__(self):
+    decoder.__init__(self)
+    self.outputs = []
+
   def print_decoder_output(self, decoder_out):
     self.decoder_out = decoder_out
+    self.outputs.append(tuple(getattr(decoder_out, name) for name in decoder_out.__slots__))
 
 # Unit test class
 class test_decode_elv_wde1(unittest.TestCase):
@@ -31,42 +36,85 @@ class test_decode_elv_wde1(unittest.TestCase):
 
     fin.close()
 
+  # Process the given file as one block with the decoder
+  def process_file_block(self, filename, decoder):
+    fin = io.open("{0}/{1}".format(path.dirname(path.abspath(__file__)), filename), mode="rb")
+    b = fin.read()
+    decoder.process_block(memoryview(b)[:len(b) - len(b) % 2].cast('h'))
+    fin.close()
+
+  # Process the given file in blocks of block_size samples with the
+  # decoder, using the same samples as process_file
+  def process_file_blocks(self, filename, decoder, block_size):
+    fin = io.open("{0}/{1}".format(path.dirname(path.abspath(__file__)), filename), mode="rb")
+    b = fin.read()
+    fin.close()
+    samples = memoryview(b)[:len(b) - len(b) % 512].cast('h')
+    for i in range(0, len(samples), block_size):
+      decoder.process_block(samples[i:i + block_size])
+
   # Feed several real-world samples into the decoder
   # and verify the decoder output
   def test_sample_1(self):
     dec = test_decoder()
     self.process_file('rtl-weather-30k-1.raw', dec)
-    self.assertEqual(dec.decoder_out['sensor_type_str'], 'Thermo/Hygro')
-    self.assertEqual(dec.decoder_out['address'], 6)
-    self.assertEqual(dec.decoder_out['temperature'], 20.2)
-    self.assertEqual(dec.decoder_out['humidity'], 61.7)
+    self.assertEqual(dec.decoder_out.sensor_type_str, 'Thermo/Hygro')
+    self.assertEqual(dec.decoder_out.address, 6)
+    self.assertEqual(dec.decoder_out.temperature, 20.2)
+    self.assertEqual(dec.decoder_out.humidity, 61.7)
 
   def test_sample_2(self):
     dec = test_decoder()
     self.process_file('rtl-weather-30k-2.raw', dec)
-    self.assertEqual(dec.decoder_out['sensor_type_str'], 'Kombi')
-    self.assertEqual(dec.decoder_out['address'], 1)
-    self.assertEqual(dec.decoder_out['temperature'], 17.6)
-    self.assertEqual(dec.decoder_out['humidity'], 54)
-    self.assertEqual(dec.decoder_out['wind'], 0)
-    self.assertEqual(dec.decoder_out['rain_sum'], 1634)
-    self.assertEqual(dec.decoder_out['rain_detect'], False)
+    self.assertEqual(dec.decoder_out.sensor_type_str, 'Kombi')
+    self.assertEqual(dec.decoder_out.address, 1)
+    self.assertEqual(dec.decoder_out.temperature, 17.6)
+    self.assertEqual(dec.decoder_out.humidity, 54)
+    self.assertEqual(dec.decoder_out.wind, 0)
+    self.assertEqual(dec.decoder_out.rain_sum, 1634)
+    self.assertEqual(dec.decoder_out.rain_detect, False)
 
   def test_sample_3(self):
     dec = test_decoder()
     self.process_file('rtl-weather-30k-3.raw', dec)
-    self.assertEqual(dec.decoder_out['sensor_type_str'], 'Thermo/Hygro')
-    self.assertEqual(dec.decoder_out['address'], 4)
-    self.assertEqual(dec.decoder_out['temperature'], 18.8)
-    self.assertEqual(dec.decoder_out['humidity'], 61.1)
+    self.assertEqual(dec.decoder_out.sensor_type_str, 'Thermo/Hygro')
+    self.assertEqual(dec.decoder_out.address, 4)
+    self.assertEqual(dec.decoder_out.temperature, 18.8)
+    self.assertEqual(dec.decoder_out.humidity, 61.1)
 
   def test_sample_4(self):
     dec = test_decoder()
     self.process_file('rtl-weather-30k-4.raw', dec)
-    self.assertEqual(dec.decoder_out['sensor_type_str'], 'Thermo/Hygro')
-    self.assertEqual(dec.decoder_out['address'], 6)
-    self.assertEqual(dec.decoder_out['temperature'], 20.4)
-    self.assertEqual(dec.decoder_out['humidity'], 61.3)
+    self.assertEqual(dec.decoder_out.sensor_type_str, 'Thermo/Hygro')
+    self.assertEqual(dec.decoder_out.address, 6)
+    self.assertEqual(dec.decoder_out.temperature, 20.4)
+    self.assertEqual(dec.decoder_out.humidity, 61.3)
+
+  # Feed a whole file at once into the decoder
+  def test_process_block(self):
+    dec = test_decoder()
+    self.process_file_block('rtl-weather-30k-2.raw', dec)
+    self.assertEqual(dec.decoder_out.sensor_type_str, 'Kombi')
+    self.assertEqual(dec.decoder_out.address, 1)
+    self.assertEqual(dec.decoder_out.temperature, 17.6)
+    self.assertEqual(dec.decoder_out.rain_sum, 1634)
+
+  # Feed the files in blocks of different sizes into the decoder, so that
+  # the decoder continues at block boundaries in every state, and
+  # verify that the output is the same as for single samples
+  def test_process_blocks(self):
+    for i in range(1, 5):
+      filename = 'rtl-weather-30k-{0}.raw'.format(i)
+      expected = test_decoder()
+      self.process_file(filename, expected)
+      self.assertTrue(expected.outputs)
+      for block_size in (1, 3, 97, 1024):
+        with self.subTest(filename=filename, block_size=block_size):
+          dec = test_decoder()
+          self.process_file_blocks(filename, dec, block_size)
+          self.assertEqual(dec.outputs, expected.outputs)
+          self.assertEqual(dec.decoder_state, expected.decoder_state)
+          self.assertEqual(dec.pulse_len, expected.pulse_len)
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Unit test for decode_mebus
+
+import io
+import unittest
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from decode_mebus import decoder
+
+# mebus-30k-1.raw is a synthetic recording made by make_mebus_recording.py
+# (see there for the signal levels and timing) with three packets:
+# id 1234, setkey 0, channel 3, 21.5 degrees, 55% humidity (3 frames)
+# id 77, setkey 1, channel 1, -3.2 degrees, 90% humidity (2 frames)
+# id 2047, setkey 0, channel 4, 99.9 degrees, 1% humidity (4 frames)
+# followed by invalid packets and noise, which are not decoded
+SAMPLE_1_OUTPUTS = [
+  (1234, 0, 3, 21.5, 55),
+  (77, 1, 1, -3.2, 90),
+  (2047, 0, 4, 99.9, 1),
+]
+
+# Test hook: store the decoder outputs into an instance variable
+# instead of printing them
+class test_decoder(decoder):
+  __slots__ = ('outputs',)
+
+  def __init__(self):
+    decoder.__init__(self)
+    self.outputs = []
+
+  def print_decoder_output(self, id, setkey, channel, temperature, humidity):
+    self.outputs.append((id, setkey, channel, temperature, humidity))
+
+# Unit test class
+class test_decode_mebus(unittest.TestCase):
+
+  # Process the given file sample by sample with the decoder
+  def process_file(self, filename, decoder):
+    fin = io.open("{0}/{1}".format(path.dirname(path.abspath(__file__)), filename), mode="rb")
+    b = fin.read()
+    fin.close()
+    for val in memoryview(b)[:len(b) - len(b) % 2].cast('h'):
+      decoder.process(val)
+
+  # Process the given file in blocks of block_size samples with the decoder
+  def process_file_blocks(self, filename, decoder, block_size):
+    fin = io.open("{0}/{1}".format(path.dirname(path.abspath(__file__)), filename), mode="rb")
+    b = fin.read()
+    fin.close()
+    samples = memoryview(b)[:len(b) - len(b) % 2].cast('h')
+    for i in range(0, len(samples), block_size):
+      decoder.process_block(samples[i:i + block_size])
+
+  # Feed a recording as one block into the decoder
+  # and verify the decoder output
+  def test_sample_1(self):
+    dec = test_decoder()
+    self.process_file_blocks('mebus-30k-1.raw', dec, 1 << 20)
+    self.assertEqual(dec.outputs, SAMPLE_1_OUTPUTS)
+
+  # process() decodes single samples the same way as process_block
+  # decodes blocks of any size, so that the decoder continues
+  # at block boundaries in every state
+  def test_process(self):
+    expected = test_decoder()
+    self.process_file('mebus-30k-1.raw', expected)
+    self.assertEqual(expected.outputs, SAMPLE_1_OUTPUTS)
+    for block_size in (1, 97, 1024):
+      with self.subTest(block_size=block_size):
+        dec = test_decoder()
+        self.process_file_blocks('mebus-30k-1.raw', dec, block_size)
+        self.assertEqual(dec.outputs, expected.outputs)
+        self.assertEqual(dec.decoder_state, expected.decoder_state)
+        self.assertEqual(dec.signal_state, expected.signal_state)
+        self.assertEqual(dec.pulse_len, expected.pulse_len)
+        self.assertEqual(dec.window(0, 90), expected.window(0, 90))
+
+  # A frame with less than 34 bits is decoded field by field,
+  # and the missing fields are 0
+  def test_short_frame(self):
+    dec = test_decoder()
+    bits = bytearray([1, 0, 0, 1, 1, 0, 1, 0, 0, 1, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1])
+    dec.frames = [bits, bytearray(bits)]
+    dec.data = bytearray(bits)
+    with self.assertLogs(level='WARNING'):
+      dec.decode()
+    self.assertEqual(dec.outputs, [(1234, 1, 3, 0.0, 0)])
+
+if __name__ == '__main__':
+  unittest.main()